@@ -14,10 +14,9 @@ from source.gui import GUI, missingFilesError
 def main():
     lex = Lex()
 
-    # Don't let program run if we are missing the default files
-    if not all([lex.readScanTable(GUI.DEF_SCAN), \
-        lex.readTokenTable(GUI.DEF_TOKEN), \
-        lex.readKeywordTable(GUI.DEF_KEY), \
+    # Don't let program run if we are missing the default files, tables come
+    # from the registry so edits to them are picked up on restarting the scan
+    if not all([lex.useTables(GUI.DEF_SCAN, GUI.DEF_TOKEN, GUI.DEF_KEY), \
         lex.readSourceCode(GUI.DEF_SOURCE)]):
         
         missingFilesError()
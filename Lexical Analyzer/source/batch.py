@@ -0,0 +1,292 @@
+# +----------------------------------------------------------------------------
+#
+# Name:     Brandon Mitchell
+# Description:  Batch mode for the lexical analyzer.  Walks whole directory
+#               trees, scans every file that matches, and writes all the
+#               tokens to one output file.  Alongside that it keeps an index
+#               with counts for each file and where its tokens are in the
+#               output, so questions like "which files have errors" can be
+#               answered without scanning anything again.  Like the GUI, it
+#               is handed a Lex with the tables already loaded.
+#
+# +----------------------------------------------------------------------------
+
+import os
+import json
+from fnmatch import fnmatch
+
+"""
+    brief:  Finds every file under the roots that should be scanned
+    params: roots: list of strings, files or directories to search
+    params: include: list of strings, glob patterns a file must match one of,
+            defaults to everything
+    params: exclude: list of strings, glob patterns that skip a file or a
+            whole directory, defaults to nothing
+    return: list of strings, the file paths in sorted order
+"""
+def findSourceFiles(roots, include = ["*"], exclude = []):
+
+    # Patterns are checked against the name and the path, so both "*.c" and
+    # "build/*" work
+    def matches(path, patterns):
+        name = os.path.basename(path)
+        return any(fnmatch(name, pattern) or fnmatch(path, pattern) \
+            for pattern in patterns)
+    
+    found = []
+    for root in roots:
+        if os.path.isfile(root):
+            found.append(root)
+            continue
+        
+        for dirPath, dirNames, fileNames in os.walk(root):
+            
+            # Pruning here keeps os.walk from going into excluded directories
+            dirNames[:] = sorted(name for name in dirNames if not \
+                matches(os.path.join(dirPath, name), exclude))
+            
+            for name in sorted(fileNames):
+                path = os.path.join(dirPath, name)
+                if matches(path, include) and not matches(path, exclude):
+                    found.append(path)
+    
+    return found
+
+"""
+    The results of a batch scan.  Keeps per file counts and a histogram of
+    token kinds, the byte range of each file's tokens in the output file, and
+    which files each identifier shows up in.  Can be saved and loaded as JSON.
+"""
+class BatchIndex:
+
+    """
+        brief:  Constructor
+        params: outputFile: string, the file holding every file's tokens
+    """
+    def __init__(self, outputFile):
+        self.outputFile = outputFile
+        
+        # One dict per file, files are referred to by their spot in this list
+        self.files = []
+        self._fileIds = {}
+        
+        # Identifier to the ids of the files it appears in
+        self.identifiers = {}
+        
+        # Files that couldn't be opened or read as text
+        self.skipped = []
+
+
+
+    """
+        brief:  Adds a scanned file to the index
+        params: path: string, the file that was scanned
+        params: tokens: int, number of tokens, not counting whiteSpace and
+                comments
+        params: errors: int, number of errors
+        params: kinds: dict, token name to how many times it showed up
+        params: identifiers: set of strings, identifiers in the file
+        params: offset: int, byte offset of the file's tokens in the output
+        params: length: int, number of bytes of tokens in the output
+    """
+    def addFile(self, path, tokens, errors, kinds, identifiers, offset, \
+        length):
+        
+        fileId = len(self.files)
+        self._fileIds[path] = fileId
+        self.files.append({"path": path, "tokens": tokens, "errors": \
+            errors, "kinds": kinds, "offset": offset, "length": length})
+        
+        for identifier in identifiers:
+            self.identifiers.setdefault(identifier, []).append(fileId)
+
+
+
+    """
+        brief:  Looks up the entry for one file
+        params: path: string, the file
+        return: dict, the file's counts and byte range, None if not scanned
+    """
+    def fileInfo(self, path):
+        fileId = self._fileIds.get(path)
+        return None if fileId is None else self.files[fileId]
+
+
+
+    """
+        brief:  Lists every file that had at least one lexical error
+        return: list of strings, the file paths
+    """
+    def filesWithErrors(self):
+        return [info["path"] for info in self.files if info["errors"]]
+
+
+
+    """
+        brief:  Lists every file an identifier shows up in
+        params: identifier: string, the identifier to look for
+        return: list of strings, the file paths
+    """
+    def filesContaining(self, identifier):
+        return [self.files[fileId]["path"] for fileId in \
+            self.identifiers.get(identifier, [])]
+
+
+
+    """
+        brief:  Adds up the token histograms of every file
+        return: dict, token name to its count over all files
+    """
+    def totalKinds(self):
+        totals = {}
+        for info in self.files:
+            for kind, count in info["kinds"].items():
+                totals[kind] = totals.get(kind, 0) + count
+        return totals
+
+
+
+    """
+        brief:  Reads one file's tokens back out of the output file without
+                reading the rest of it
+        params: path: string, the file
+        return: string, the output lines for the file
+    """
+    def readTokens(self, path):
+        info = self.fileInfo(path)
+        if info is None:
+            raise KeyError(path)
+        
+        with open(self.outputFile, 'rb') as file:
+            file.seek(info["offset"])
+            return file.read(info["length"]).decode("utf-8")
+
+
+
+    """
+        brief:  Writes the index out as JSON
+        params: fileName: string, where to save it
+    """
+    def save(self, fileName):
+        with open(fileName, 'w') as file:
+            json.dump({"outputFile": self.outputFile, "files": self.files, \
+                "identifiers": self.identifiers, "skipped": self.skipped}, \
+                file)
+
+
+
+    """
+        brief:  Reads an index saved with save
+        params: fileName: string, the JSON file
+        return: BatchIndex, the loaded index
+    """
+    @staticmethod
+    def load(fileName):
+        with open(fileName) as file:
+            data = json.load(file)
+        
+        index = BatchIndex(data["outputFile"])
+        index.files = data["files"]
+        index._fileIds = {info["path"]: fileId for fileId, info in \
+            enumerate(index.files)}
+        index.identifiers = data["identifiers"]
+        index.skipped = data["skipped"]
+        return index
+
+"""
+    brief:  Scans every file under the roots and builds the index
+    params: lexicalAnalyzer: Lex, a Lex object with all tables loaded, its
+            source file gets replaced for each file scanned
+    params: roots: list of strings, files or directories to search
+    params: outputFile: string, where to write every file's tokens
+    params: include: list of strings, glob patterns to scan, defaults to
+            everything
+    params: exclude: list of strings, glob patterns to skip, defaults to
+            nothing
+    return: BatchIndex, the results
+"""
+def scanTree(lexicalAnalyzer, roots, outputFile, include = ["*"], \
+    exclude = []):
+    
+    index = BatchIndex(outputFile)
+    
+    # Write in binary so the offsets are real byte offsets
+    with open(outputFile, 'wb') as output:
+        offset = 0
+        
+        for path in findSourceFiles(roots, include, exclude):
+            
+            # Don't scan the output back into itself
+            if os.path.abspath(path) == os.path.abspath(outputFile):
+                continue
+            
+            if not lexicalAnalyzer.readSourceCode(path):
+                index.skipped.append(path)
+                continue
+            
+            # Same format as the GUI's output panel
+            lines = ["~ {} ~\n".format(path)]
+            tokens = 0
+            errors = 0
+            kinds = {}
+            identifiers = set()
+            
+            while not lexicalAnalyzer.eof():
+                lexicalAnalyzer.getNextToken()
+                token = lexicalAnalyzer.curToken
+                
+                if token in {"whiteSpace", "comment"}:
+                    continue
+                
+                tokens += 1
+                if lexicalAnalyzer.errorFlag:
+                    errors += 1
+                    lines.append(lexicalAnalyzer.errorMessage + '\n')
+                    continue
+                
+                kinds[token] = kinds.get(token, 0) + 1
+                if token == "identifier":
+                    identifiers.add(lexicalAnalyzer.curLexemme)
+                lines.append("Token: {:<12} Lexemme: {}\n".format(token, \
+                    lexicalAnalyzer.curLexemme))
+            
+            # One write per file instead of one per token
+            data = "".join(lines).encode("utf-8")
+            output.write(data)
+            
+            index.addFile(path, tokens, errors, kinds, identifiers, offset, \
+                len(data))
+            offset += len(data)
+    
+    return index
+
+# Command line use, run from the source folder like testLex.py
+if __name__ == "__main__":
+    import argparse
+    import lex
+    import gui
+    
+    parser = argparse.ArgumentParser(description = "Scan whole directories " \
+        "with the lexical analyzer.")
+    parser.add_argument("roots", nargs = "+", help = "files or directories")
+    parser.add_argument("--include", action = "append", help = "glob " \
+        "pattern of files to scan, can be repeated")
+    parser.add_argument("--exclude", action = "append", default = [], \
+        help = "glob pattern of files or directories to skip, can be repeated")
+    parser.add_argument("--output", default = "tokens.txt", help = "file " \
+        "to write the tokens to")
+    parser.add_argument("--index", default = "tokens.json", help = "file " \
+        "to save the index to")
+    args = parser.parse_args()
+    
+    scanner = lex.Lex()
+    scanner.readScanTable("../" + gui.GUI.DEF_SCAN)
+    scanner.readTokenTable("../" + gui.GUI.DEF_TOKEN)
+    scanner.readKeywordTable("../" + gui.GUI.DEF_KEY)
+    
+    index = scanTree(scanner, args.roots, args.output, args.include or \
+        ["*"], args.exclude)
+    index.save(args.index)
+    
+    print("Scanned {} files, {} with errors, {} skipped".format( \
+        len(index.files), len(index.filesWithErrors()), len(index.skipped)))
\ No newline at end of file
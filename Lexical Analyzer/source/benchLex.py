@@ -0,0 +1,59 @@
+# +----------------------------------------------------------------------------
+#
+# Name:     Brandon Mitchell
+# Description:  Times the table interpreter in Lex against the start regexes in
+#               RegexLex.  Run from the source folder like testLex.py, reads
+#               every test file, repeats them to make something worth timing,
+#               and prints the tokens per second for each.
+#
+# +----------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import lex
+from lex import makeLex
+
+"""
+    brief:  Scans a file with a fresh analyzer and times it
+    params: lexClass: class, Lex or a subclass of it
+    params: fileName: string, the source file to scan
+    return: tuple, the number of tokens and the seconds it took
+"""
+def timeScan(lexClass, fileName):
+
+    # Tables are compiled up front, only the scanning is timed
+    scanner = makeLex(lexClass)
+    scanner.readSourceCode(fileName)
+    
+    count = 0
+    start = time.perf_counter()
+    while not scanner.eof():
+        scanner.getNextToken()
+        count += 1
+        
+    return count, time.perf_counter() - start
+
+if __name__ == "__main__":
+
+    # How many times to repeat the test files, can be given on command line
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    
+    sourceDir = lex.DEF_SOURCE_DIR
+    text = ""
+    for fileName in sorted(os.listdir(sourceDir)):
+        with open(os.path.join(sourceDir, fileName)) as file:
+            text += file.read() + '\n'
+            
+    # Write the corpus out as readSourceCode wants a file
+    corpus = "benchCorpus.tmp"
+    with open(corpus, 'w') as file:
+        file.write(text * repeat)
+    
+    try:
+        for lexClass in [lex.Lex, lex.RegexLex]:
+            count, seconds = timeScan(lexClass, corpus)
+            print("{:<10} {:>8} tokens {:>8.3f} s {:>10.0f} tokens/s".format( \
+                lexClass.__name__, count, seconds, count / seconds))
+    finally:
+        os.remove(corpus)
\ No newline at end of file
@@ -0,0 +1,349 @@
+# +----------------------------------------------------------------------------
+#
+# Name:     Brandon Mitchell
+# Description:  Finds copy and pasted code using the token stream.  Each file
+#               is scanned once, white space and comments are thrown out, and
+#               a rolling hash runs over every n tokens in a row.  Winnowing
+#               keeps only the smallest hash in each window, which still
+#               catches every long enough match but stores far fewer hashes.
+#               Those go in an SQLite inverted index on disk, hash to where it
+#               was seen, so finding the duplicates of one file is a lookup
+#               per fingerprint instead of comparing it to every other file.
+#               Like the GUI, it is handed a Lex with the tables loaded.
+#
+# +----------------------------------------------------------------------------
+
+import os
+import zlib
+import sqlite3
+from collections import deque
+import batch
+
+# Tokens per hash and hashes per window, any match at least WINDOW + NGRAM - 1
+# tokens long is guaranteed to be found
+NGRAM = 12
+WINDOW = 8
+
+# Polynomial rolling hash, the modulus is a prime that fits in SQLite's
+# 64 bit integers
+HASH_BASE = 1000003
+HASH_MOD = (1 << 61) - 1
+
+"""
+    brief:  Scans a source file and gives back a value for each token that
+            matters for matching
+    params: lexicalAnalyzer: Lex, a Lex object with all tables loaded, its
+            source gets replaced
+    params: text: string, the source code
+    params: normalize: bool, treat every identifier as the same so renamed
+            variables still match, defaults to True
+    return: list of tuples, (value, startLine, endLine) for each token
+"""
+def tokenValues(lexicalAnalyzer, text, normalize = True):
+    lexicalAnalyzer.setSourceCode(text)
+    
+    # Lex strips the front of the file, count those lines ourselves
+    stripped = text.strip()
+    line = 1 + text[:len(text) - len(text.lstrip())].count('\n')
+    pos = 0
+    
+    # Same token always gets the same value, even between runs, so the index
+    # on disk stays good
+    cache = {}
+    values = []
+    
+    while not lexicalAnalyzer.eof():
+        lexicalAnalyzer.getNextToken()
+        token = lexicalAnalyzer.curToken
+        
+        start = lexicalAnalyzer.curStart
+        line += stripped.count('\n', pos, start)
+        pos = start
+        
+        # Errors have no token to match on
+        if token in {"whiteSpace", "comment"} or lexicalAnalyzer.errorFlag:
+            continue
+        
+        key = token
+        if token == "identifier" and not normalize:
+            key = token + ':' + lexicalAnalyzer.curLexemme
+        
+        value = cache.get(key)
+        if value is None:
+            value = cache[key] = zlib.crc32(key.encode("utf-8")) + 1
+        
+        values.append((value, line, line + \
+            lexicalAnalyzer.curLexemme.count('\n')))
+    
+    return values
+
+"""
+    brief:  Hashes every run of NGRAM tokens and winnows them down
+    params: values: list of tuples, from tokenValues
+    params: ngram: int, tokens per hash, defaults to NGRAM
+    params: window: int, hashes per window, defaults to WINDOW
+    return: list of tuples, (hash, startLine, endLine) for each fingerprint
+"""
+def winnow(values, ngram = NGRAM, window = WINDOW):
+    if len(values) < ngram:
+        return []
+    
+    # Rolling hash, drop the token falling out the front and add the new one
+    hashes = []
+    topPower = pow(HASH_BASE, ngram - 1, HASH_MOD)
+    curHash = 0
+    for i, (value, startLine, endLine) in enumerate(values):
+        if i >= ngram:
+            curHash = (curHash - values[i - ngram][0] * topPower) % HASH_MOD
+        curHash = (curHash * HASH_BASE + value) % HASH_MOD
+        if i >= ngram - 1:
+            hashes.append(curHash)
+    
+    # Keep the smallest hash of each window, the rightmost one on ties, and
+    # only record it once no matter how many windows pick it.  The deque
+    # holds candidates with rising hashes so each window is quick.
+    prints = []
+    candidates = deque()
+    lastPicked = -1
+    for i, curHash in enumerate(hashes):
+        while candidates and hashes[candidates[-1]] >= curHash:
+            candidates.pop()
+        candidates.append(i)
+        
+        if candidates[0] <= i - window:
+            candidates.popleft()
+        
+        if i >= window - 1 or i == len(hashes) - 1:
+            picked = candidates[0]
+            if picked != lastPicked:
+                prints.append((hashes[picked], values[picked][1], \
+                    values[picked + ngram - 1][2]))
+                lastPicked = picked
+    
+    return prints
+
+"""
+    On disk inverted index of fingerprints.  Files are only rescanned when
+    their modified time or size changes, and their old fingerprints are
+    swapped out for the new ones, so keeping a big tree up to date only costs
+    the files that changed.
+"""
+class FingerprintIndex:
+
+    """
+        brief:  Constructor, opens or creates the index
+        params: fileName: string, the SQLite file, ":memory:" works too
+        params: lexicalAnalyzer: Lex, a Lex object with all tables loaded
+        params: normalize: bool, treat every identifier as the same, defaults
+                to True
+        params: ngram: int, tokens per hash, defaults to NGRAM
+        params: window: int, hashes per window, defaults to WINDOW
+        throws: ValueError if the index was made with other settings
+    """
+    def __init__(self, fileName, lexicalAnalyzer, normalize = True, \
+        ngram = NGRAM, window = WINDOW):
+        
+        self.lex = lexicalAnalyzer
+        self.normalize = normalize
+        self.ngram = ngram
+        self.window = window
+        
+        self._db = sqlite3.connect(fileName)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS settings (name " \
+                "TEXT PRIMARY KEY, value INTEGER)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS files (id INTEGER " \
+                "PRIMARY KEY, path TEXT UNIQUE, mtime INTEGER, size INTEGER)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS prints (hash " \
+                "INTEGER, file INTEGER, startLine INTEGER, endLine INTEGER)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS printsByHash ON " \
+                "prints (hash)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS printsByFile ON " \
+                "prints (file)")
+            
+            # Hashes made with different settings would never match
+            settings = {"normalize": int(normalize), "ngram": ngram, \
+                "window": window}
+            for name, value in settings.items():
+                self._db.execute("INSERT OR IGNORE INTO settings VALUES " \
+                    "(?, ?)", (name, value))
+            saved = dict(self._db.execute("SELECT name, value FROM settings"))
+            if saved != settings:
+                raise ValueError("Index was made with other settings: " \
+                    "{}".format(saved))
+
+
+
+    """
+        brief:  Closes the index
+    """
+    def close(self):
+        self._db.close()
+
+
+
+    """
+        brief:  Scans a file and stores its fingerprints if it is new or has
+                changed since the last time
+        params: path: string, the file
+        return: bool, True if the file was scanned
+        throws: OSError if the file can't be read
+    """
+    def update(self, path):
+        path = os.path.abspath(path)
+        info = os.stat(path)
+        
+        row = self._db.execute("SELECT id, mtime, size FROM files WHERE " \
+            "path = ?", (path,)).fetchone()
+        if row is not None and row[1:] == (info.st_mtime_ns, info.st_size):
+            return False
+        
+        # Read it ourselves so line numbers can be worked out from it
+        with open(path, 'rb') as file:
+            data = file.read()
+        try:
+            text = data.decode("utf-8")
+        except UnicodeDecodeError:
+            text = data.decode("latin-1")
+        
+        prints = winnow(tokenValues(self.lex, text, self.normalize), \
+            self.ngram, self.window)
+        
+        # All or nothing, a crash halfway leaves the old fingerprints
+        with self._db:
+            if row is not None:
+                self._db.execute("DELETE FROM prints WHERE file = ?", \
+                    (row[0],))
+                self._db.execute("UPDATE files SET mtime = ?, size = ? " \
+                    "WHERE id = ?", (info.st_mtime_ns, info.st_size, row[0]))
+                fileId = row[0]
+            else:
+                fileId = self._db.execute("INSERT INTO files (path, mtime, " \
+                    "size) VALUES (?, ?, ?)", (path, info.st_mtime_ns, \
+                    info.st_size)).lastrowid
+            
+            self._db.executemany("INSERT INTO prints VALUES (?, ?, ?, ?)", \
+                [(curHash, fileId, startLine, endLine) for curHash, \
+                startLine, endLine in prints])
+        
+        return True
+
+
+
+    """
+        brief:  Takes a file out of the index
+        params: path: string, the file
+    """
+    def remove(self, path):
+        path = os.path.abspath(path)
+        with self._db:
+            row = self._db.execute("SELECT id FROM files WHERE path = ?", \
+                (path,)).fetchone()
+            if row is not None:
+                self._db.execute("DELETE FROM prints WHERE file = ?", row)
+                self._db.execute("DELETE FROM files WHERE id = ?", row)
+
+
+
+    """
+        brief:  Brings a whole tree up to date, only changed files are
+                scanned and files that are gone are taken out
+        params: roots: list of strings, files or directories to search
+        params: include: list of strings, glob patterns to index, defaults to
+                everything
+        params: exclude: list of strings, glob patterns to skip, defaults to
+                nothing
+        return: list of strings, the files that were scanned
+    """
+    def updateTree(self, roots, include = ["*"], exclude = []):
+        scanned = []
+        for path in batch.findSourceFiles(roots, include, exclude):
+            try:
+                if self.update(path):
+                    scanned.append(path)
+            except OSError:
+                continue
+        
+        for (path,) in self._db.execute("SELECT path FROM files").fetchall():
+            if not os.path.exists(path):
+                self.remove(path)
+        
+        return scanned
+
+
+
+    """
+        brief:  Finds code in other files that looks like it was copied from
+                or into this one, the file must be in the index
+        params: path: string, the file
+        return: list of tuples, (otherPath, startLine, endLine, otherStart,
+                otherEnd) for each region, sorted by file and line
+    """
+    def duplicates(self, path):
+        path = os.path.abspath(path)
+        row = self._db.execute("SELECT id FROM files WHERE path = ?", \
+            (path,)).fetchone()
+        if row is None:
+            raise KeyError(path)
+        
+        # One indexed lookup per fingerprint of this file
+        matches = self._db.execute("SELECT other.path, mine.startLine, " \
+            "mine.endLine, theirs.startLine, theirs.endLine FROM prints " \
+            "AS mine JOIN prints AS theirs ON theirs.hash = mine.hash JOIN " \
+            "files AS other ON other.id = theirs.file WHERE mine.file = ? " \
+            "AND theirs.file != mine.file ORDER BY other.path, " \
+            "mine.startLine, theirs.startLine", row).fetchall()
+        
+        # Join fingerprints that overlap on both sides into one region
+        regions = []
+        for match in matches:
+            if regions:
+                last = regions[-1]
+                if last[0] == match[0] and match[1] <= last[2] + 1 and \
+                    match[3] <= last[4] + 1 and match[4] >= last[3] - 1:
+                    regions[-1] = (last[0], last[1], max(last[2], match[2]), \
+                        min(last[3], match[3]), max(last[4], match[4]))
+                    continue
+            regions.append(match)
+        
+        return regions
+
+# Command line use, run from the source folder like testLex.py
+if __name__ == "__main__":
+    import argparse
+    import lex
+    import gui
+    
+    parser = argparse.ArgumentParser(description = "Find copy and pasted " \
+        "code with token fingerprints.")
+    parser.add_argument("roots", nargs = "+", help = "files or directories")
+    parser.add_argument("--include", action = "append", help = "glob " \
+        "pattern of files to index, can be repeated")
+    parser.add_argument("--exclude", action = "append", default = [], \
+        help = "glob pattern of files or directories to skip, can be repeated")
+    parser.add_argument("--index", default = "fingerprints.db", help = \
+        "SQLite file to keep the index in")
+    parser.add_argument("--exact", action = "store_true", help = "don't " \
+        "treat renamed identifiers as the same")
+    args = parser.parse_args()
+    
+    scanner = lex.Lex()
+    scanner.useTables("../" + gui.GUI.DEF_SCAN, "../" + gui.GUI.DEF_TOKEN, \
+        "../" + gui.GUI.DEF_KEY)
+    
+    index = FingerprintIndex(args.index, scanner, not args.exact)
+    scanned = index.updateTree(args.roots, args.include or ["*"], \
+        args.exclude)
+    print("Scanned {} changed files".format(len(scanned)))
+    
+    for path in batch.findSourceFiles(args.roots, args.include or ["*"], \
+        args.exclude):
+        try:
+            regions = index.duplicates(path)
+        except KeyError:
+            continue
+        for other, start, end, otherStart, otherEnd in regions:
+            print("{}:{}-{} looks like {}:{}-{}".format(path, start, end, \
+                other, otherStart, otherEnd))
+    
+    index.close()
\ No newline at end of file
@@ -346,11 +346,13 @@ class GUI:
 
     """
         brief:  Lets the user know that the file could not be opened.
+        params: detail: string, extra info on what was wrong, defaults to ""
     """
-    def _errorUserFileError(self, fileName):
+    def _errorUserFileError(self, fileName, detail = ""):
         messagebox.showerror(title = " Error Opening File!", message = \
             "\"{}\" could not be opened.  Ensure it exists and is of the " \
-            "proper type (text files, not binary).".format(fileName))
+            "proper type (text files, not binary).\n\n{}".format(fileName, \
+            detail).strip())
 
 
 
@@ -417,7 +419,7 @@ class GUI:
                     
                 # File is too large, doesn't exist, or is not text data
                 else:
-                    self._errorUserFileError(fileName)
+                    self._errorUserFileError(fileName, self.lex.tableError)
 
 
 
@@ -448,7 +450,7 @@ class GUI:
                 
                 # File is too large, doesn't exist, or is not text data
                 else:
-                    self._errorUserFileError(fileName)
+                    self._errorUserFileError(fileName, self.lex.tableError)
 
 
 
@@ -479,7 +481,7 @@ class GUI:
                 
                 # File is too large, doesn't exist, or is not text data
                 else:
-                    self._errorUserFileError(fileName)
+                    self._errorUserFileError(fileName, self.lex.tableError)
 
 
 
@@ -12,6 +12,28 @@
 #
 # +----------------------------------------------------------------------------
 
+# NumPy is optional, it is only used for the vectorized pre-pass.  Without it
+# the analyzer just steps through the source one character at a time.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import os
+import re
+import sys
+import hashlib
+import threading
+from bisect import bisect_right
+from collections import namedtuple, OrderedDict
+
+# What the lookahead buffer keeps for each token, a plain tuple underneath so
+# it stays small, start is the index of the lexemme in the source, kind is
+# the token's integer id from Lex.kindNames, and symbol is the lexemme's id
+# from Lex.symbols, -1 if it isn't interned
+TokenRecord = namedtuple("TokenRecord", ["token", "lexemme", "errorMessage", \
+    "start", "kind", "symbol"])
+
 """
     brief:  Reads in CSV files
     params: delim: string, the delimiter to use, defaults to comma
@@ -22,8 +44,124 @@ def csvReader(fileName, delim = ','):
     # Read whole file, split at newlines, and then split at commas
     with open(fileName) as f:
         text = [line.split(delim) for line in f.read().split('\n')]
+        
+    # A file ending in a newline leaves an empty row behind, toss those
+    while text and text[-1] == ['']:
+        text.pop()
     return text
 
+"""
+    brief:  Sorts code point ranges and joins any that overlap or touch
+    params: ranges: iterable of tuples, (low, high) code points, inclusive
+    return: list of tuples, the merged ranges
+"""
+def mergeRanges(ranges):
+    merged = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+        else:
+            merged.append((low, high))
+    return merged
+
+"""
+    brief:  Writes a regex character class for a set of code points
+    params: ranges: iterable of tuples, (low, high) code points, inclusive
+    params: negate: bool, match everything but the code points, defaults to
+            False
+    return: string, the character class
+"""
+def charClass(ranges, negate = False):
+    ranges = mergeRanges(ranges)
+    
+    # Nothing in the class, either never match or match anything
+    if not ranges:
+        return "(?s:.)" if negate else "(?!)"
+    
+    # Escape everything by number, no worrying about ] or - or ^
+    def escape(code):
+        if code < 256:
+            return "\\x{:02x}".format(code)
+        return "\\U{:08x}".format(code)
+    
+    if len(ranges) == 1 and ranges[0][0] == ranges[0][1] and not negate:
+        return escape(ranges[0][0])
+    
+    parts = []
+    for low, high in ranges:
+        if low == high:
+            parts.append(escape(low))
+        else:
+            parts.append("{}-{}".format(escape(low), escape(high)))
+        
+    return "[{}{}]".format("^" if negate else "", "".join(parts))
+
+"""
+    String pool for lexemmes.  Every distinct string gets one integer id and
+    one shared copy, so keeping lots of tokens around only costs memory for 
+    the unique names.  Can be bounded, then the least recently seen string is
+    thrown out.  Ids are never handed out twice, so an old id can't end up
+    naming some other string.
+"""
+class SymbolPool:
+
+    """
+        brief:  Constructor
+        params: maxSize: int, most strings to hold before evicting, defaults
+                to None for no limit
+    """
+    def __init__(self, maxSize = None):
+        self.maxSize = maxSize
+        self._ids = OrderedDict()
+        self._names = {}
+        self._nextId = 0
+
+
+
+    """
+        brief:  Finds or adds a string to the pool
+        params: text: string, the string to intern
+        return: tuple, the int id and the pooled copy of the string
+    """
+    def intern(self, text):
+        symbol = self._ids.get(text)
+        
+        if symbol is not None:
+        
+            # Only bounded pools care what was seen last
+            if self.maxSize is not None:
+                self._ids.move_to_end(text)
+            return symbol, self._names[symbol]
+            
+        symbol = self._nextId
+        self._nextId += 1
+        self._ids[text] = symbol
+        self._names[symbol] = text
+        
+        if self.maxSize is not None and len(self._ids) > self.maxSize:
+            oldText, oldSymbol = self._ids.popitem(last = False)
+            del self._names[oldSymbol]
+            
+        return symbol, text
+
+
+
+    """
+        brief:  Looks up the string for an id
+        params: symbol: int, an id from intern
+        return: string, or None if it was evicted
+    """
+    def name(self, symbol):
+        return self._names.get(symbol)
+
+
+
+    """
+        brief:  Number of strings in the pool
+    """
+    def __len__(self):
+        return len(self._ids)
+
 """
     Lexical analyzer class, requires three tables and source code program to
     run, will use info in tokenTable to give useful errors, only reads one
@@ -31,22 +169,390 @@ def csvReader(fileName, delim = ','):
 """
 class Lex:
 
+    # Tokens whose lexemmes aren't put in the symbol pool
+    NOT_INTERNED = {"comment"}
+
+    # Fewest self-loop characters a state needs to get a regex fast path
+    HOT_STATE_MIN_CHARS = 3
+    
+    # Shortest self-loop run the pre-pass jumps over, stepping through a few
+    # characters is quicker than looking the run up
+    PRE_PASS_MIN_RUN = 4
+    
+    # Share of the characters scanned that must have been stepped through one
+    # at a time for the pre-pass to be built, decided once a sample of the
+    # file has been scanned.  It costs about as much as stepping through a
+    # slice of the file, so a file of a few long hot state tokens is better 
+    # off without it.
+    PRE_PASS_MIN_SHARE = 0.125
+    PRE_PASS_SAMPLE = 1024
+    
+    # Everything a compiled table set is made of, swapped in all at once when
+    # tables come from a TableRegistry
+    TABLE_ATTRS = ("_scanTable", "_tokenTable", "_keywordTable", "_columns", \
+        "_transitions", "_asciiCols", "_rangeStarts", "_rangeEnds", \
+        "_rangeCols", "_otherCol", "_otherRanges", "_stateToken", \
+        "_stateDead", "_stateRun", "kindNames", "_kindIds", "_compiled")
+
     """
         brief:  Looks into the scanning table to return the proper action
         pre:    Assumes tables exist and are properly loaded
-        return: string, the state to move to, either '-' or a number string
+        return: int, the state to move to, 0 if there is no transition
     """
     def _findAction(self, curChar, curState):
         
         # Character stored in table as int, best way to represent without any
         # issues arising from escape sequences or tabs and the like
-        charVal = str(ord(curChar))
+        code = ord(curChar)
+        
+        # ASCII is a straight array lookup, everything else is a binary 
+        # search through the ranges
+        if code < 128:
+            col = self._asciiCols[code]
+        else:
+            i = bisect_right(self._rangeStarts, code) - 1
+            if i >= 0 and code <= self._rangeEnds[i]:
+                col = self._rangeCols[i]
+            else:
+                col = self._otherCol
+        
+        if col is None:
+            return 0
+        return self._transitions[curState][col]
+
+
+
+    """
+        brief:  Reads a scan table header, each column is a code point like 
+                "97", a range like "128-1114111", or "other" for anything not
+                in another column
+        params: header: list of strings, row 0 of the scan table
+        return: list, a (low, high) tuple per column, None for "other"
+        throws: ValueError if the header is malformed
+    """
+    def _parseHeader(self, header):
+        columns = []
+        for val in header:
+            if val == "other":
+                if None in columns:
+                    raise ValueError("Scan table header has more than one " \
+                        "other column")
+                columns.append(None)
+                continue
+                
+            # Numbers must be written plainly, same as before ranges
+            bounds = val.split('-')
+            if len(bounds) > 2 or not all(bound.isdigit() and \
+                str(int(bound)) == bound for bound in bounds):
+                raise ValueError("Scan table header has a bad character " \
+                    "code: '{}'".format(val))
+            
+            low, high = int(bounds[0]), int(bounds[-1])
+            if low > high or high > sys.maxunicode:
+                raise ValueError("Scan table header has a bad character " \
+                    "range: '{}'".format(val))
+            columns.append((low, high))
+        
+        # Every character can only land in one column
+        spans = sorted(span for span in columns if span is not None)
+        for first, second in zip(spans, spans[1:]):
+            if second[0] <= first[1]:
+                raise ValueError("Scan table header has overlapping " \
+                    "columns: {} and {}".format(first, second))
+                    
+        return columns
+
+
+
+    """
+        brief:  Builds the two level character lookup, an array for ASCII
+                and sorted ranges for everything else
+        post:   self._asciiCols, self._rangeStarts, self._rangeEnds,
+                self._rangeCols, self._otherCol, and self._otherRanges are set
+    """
+    def _buildCharLookup(self):
+        self._otherCol = None
+        if None in self._columns:
+            self._otherCol = self._columns.index(None)
+        
+        self._asciiCols = [self._otherCol] * 128
+        spans = []
+        for col, span in enumerate(self._columns):
+            if span is None:
+                continue
+            low, high = span
+            for code in range(low, min(high, 127) + 1):
+                self._asciiCols[code] = col
+            if high >= 128:
+                spans.append((max(low, 128), high, col))
+        
+        spans.sort()
+        self._rangeStarts = [low for low, high, col in spans]
+        self._rangeEnds = [high for low, high, col in spans]
+        self._rangeCols = [col for low, high, col in spans]
+        
+        # Everything the "other" column stands for
+        self._otherRanges = []
+        nextCode = 0
+        for low, high in mergeRanges(span for span in self._columns \
+            if span is not None):
+            if low > nextCode:
+                self._otherRanges.append((nextCode, low - 1))
+            nextCode = high + 1
+        if nextCode <= sys.maxunicode:
+            self._otherRanges.append((nextCode, sys.maxunicode))
+
+
+
+    """
+        brief:  Finds the characters whose move out of a state passes a test
+        params: state: int, the state
+        params: test: function, takes the state moved to, 0 for none
+        return: list of tuples, merged (low, high) code point ranges
+    """
+    def _actionRanges(self, state, test):
+        row = self._transitions[state]
+        ranges = []
+        for col, span in enumerate(self._columns):
+            if test(row[col]):
+                ranges += self._otherRanges if span is None else [span]
+        
+        # With no "other" column, unlisted characters have no move
+        if self._otherCol is None and test(0):
+            ranges += self._otherRanges
+        return mergeRanges(ranges)
+
+
+
+    """
+        brief:  Checks the shape and contents of a scan table
+        params: table: 2D matrix of strings, as returned by csvReader
+        return: tuple, the columns from _parseHeader and a 2D matrix of ints,
+                the transitions with 0 meaning none, row 0 is left empty 
+                since it is the header
+        throws: ValueError if the table is malformed
+    """
+    def _validateScanTable(self, table):
+        if len(table) < 2:
+            raise ValueError("Scan table needs a header row and at least " \
+                "one state")
         
-        if charVal in self._scanTable[0]:
-            colVal = self._scanTable[0].index(charVal)
-            return self._scanTable[curState][colVal]
+        header = table[0]
+        columns = self._parseHeader(header)
         
-        return '-'
+        transitions = [[]]
+        for state in range(1, len(table)):
+            row = table[state]
+            if len(row) != len(header):
+                raise ValueError("Scan table row {} has {} columns, " \
+                    "expected {}".format(state, len(row), len(header)))
+            
+            newRow = []
+            for action in row:
+                if action == '-':
+                    newRow.append(0)
+                elif action.isdigit() and 1 <= int(action) < len(table):
+                    newRow.append(int(action))
+                else:
+                    raise ValueError("Scan table row {} moves to a state " \
+                        "that does not exist: '{}'".format(state, action))
+            transitions.append(newRow)
+            
+        return columns, transitions
+
+
+
+    """
+        brief:  Checks that a token or keyword table has one entry per row
+        params: table: 2D matrix of strings, as returned by csvReader
+        params: name: string, name of the table for the error message
+        return: list of strings, the entries
+        throws: ValueError if the table is malformed
+    """
+    def _validateListTable(self, table, name):
+        for row, word in enumerate(table):
+            if len(word) != 1 or not word[0]:
+                raise ValueError("{} table row {} must have exactly one " \
+                    "entry".format(name, row))
+        return [word[0] for word in table]
+
+
+
+    """
+        brief:  Cross checks the scan and token tables and precomputes the
+                per state info used by getNextToken
+        post:   self.tableError describes the problem if there is one, 
+                self._stateToken, self._stateDead, and self.kindNames are
+                filled in
+        return: bool, True or False if the tables are usable
+    """
+    def compileTables(self):
+        self.tableError = ""
+        self._compiled = False
+        
+        numStates = len(self._transitions)
+        if numStates < 2:
+            self.tableError = "No scan table loaded"
+            return False
+        
+        # Token table row 0 lines up with the scan table header, so both
+        # tables must be exactly the same length
+        if len(self._tokenTable) != numStates:
+            self.tableError = "Token table has {} entries but the scan " \
+                "table has {} states".format(len(self._tokenTable) - 1, \
+                numStates - 1)
+            return False
+        
+        # Walk the DFA from the start state, any state never reached is most
+        # likely an off by one in the table
+        reached = {1}
+        toVisit = [1]
+        while toVisit:
+            for nextState in self._transitions[toVisit.pop()]:
+                if nextState and nextState not in reached:
+                    reached.add(nextState)
+                    toVisit.append(nextState)
+        
+        unreached = [str(state) for state in range(1, numStates) \
+            if state not in reached]
+        if unreached:
+            self.tableError = "States can not be reached from the start " \
+                "state: {}".format(", ".join(unreached))
+            return False
+            
+        # None marks an error state, errors are prepended with '-'
+        self._stateToken = [None if tok[0] == '-' else tok \
+            for tok in self._tokenTable]
+        
+        # Dead states have no way out, no need to read another character to
+        # find out the token is over
+        self._stateDead = [not any(row) for row in self._transitions]
+        
+        # Integer ids for every token a consumer can see, 0 is for errors,
+        # keywords come after the token table's names
+        self.kindNames = [""]
+        for tok in self._stateToken:
+            if tok is not None and tok not in self.kindNames:
+                self.kindNames.append(tok)
+        for keyword in sorted(self._keywordTable):
+            if keyword not in self.kindNames:
+                self.kindNames.append(keyword)
+        self._kindIds = {tok: kind for kind, tok in enumerate(self.kindNames)}
+        
+        self._stateRun = self._findHotStates()
+        
+        self._compiled = True
+        return True
+
+
+
+    """
+        brief:  Finds states that mostly loop back on themselves, like 
+                identifiers, white space, and comment or string bodies, and 
+                compiles a regex that eats the whole loop in one go
+        pre:    self._transitions has been validated
+        return: dict, state to the match method of its compiled regex
+    """
+    def _findHotStates(self):
+        stateRun = {}
+        
+        # Count characters not columns, a range column can hold thousands
+        def size(ranges):
+            return sum(high - low + 1 for low, high in ranges)
+        
+        for state in range(1, len(self._transitions)):
+            loops = self._actionRanges(state, lambda action: action == state)
+            moves = self._actionRanges(state, lambda action: action != 0)
+            
+            # A loop over one or two characters isn't worth leaving the loop
+            # in getNextToken for
+            if size(loops) >= self.HOT_STATE_MIN_CHARS and \
+                size(loops) * 2 > size(moves):
+                pattern = charClass(loops) + "+"
+                stateRun[state] = re.compile(pattern).match
+        
+        return stateRun
+
+
+
+    """
+        brief:  Vectorized pre-pass, maps the whole source to column ids of
+                the scan table and finds where the self-loop runs end for the
+                states that don't have a hot state regex
+        pre:    numpy is available, tables are compiled and source is loaded
+        post:   self._classes holds the column id of every character, 
+                self._classRows is the transitions with an extra column for 
+                characters that have none, and self._runEnds maps a state to
+                the sorted starts and ends of its runs long enough to jump
+    """
+    def _buildPrePass(self):
+        self._runEnds = {}
+        
+        numCols = len(self._columns)
+        
+        # Characters with no column at all get an extra one on the end that
+        # never moves anywhere
+        noCol = numCols if self._otherCol is None else self._otherCol
+        self._classRows = [row + [0] for row in self._transitions]
+        
+        # Smallest type that holds every column id, one byte for most tables
+        dtype = numpy.uint8 if numCols < 255 else numpy.int32
+        asciiLookup = numpy.array([noCol if col is None else col for col in \
+            self._asciiCols], dtype = dtype)
+        
+        # Lone surrogates can come in through setSourceCode, keep them as 
+        # their own code points like the plain loop does
+        chars = numpy.frombuffer(self._sourceFile.encode("utf-32-le", \
+            "surrogatepass"), dtype = numpy.uint32)
+        classes = numpy.full(len(chars), noCol, dtype = dtype)
+        
+        # Same two levels as _findAction, but for the whole file at once
+        isAscii = chars < 128
+        classes[isAscii] = asciiLookup[chars[isAscii]]
+        
+        if self._rangeStarts:
+            others = numpy.flatnonzero(~isAscii)
+            codes = chars[others]
+            which = numpy.searchsorted(self._rangeStarts, codes, "right") - 1
+            inRange = (which >= 0) & (codes <= numpy.array(self._rangeEnds + \
+                [0])[which])
+            classes[others[inRange]] = numpy.array(self._rangeCols, \
+                dtype = dtype)[which[inRange]]
+        
+        # Indexing a memoryview gives plain ints, much quicker than numpy's
+        self._classes = memoryview(classes)
+        
+        for state in range(1, len(self._transitions)):
+            
+            # Hot states already have a regex that does this
+            if state in self._stateRun:
+                continue
+            
+            loops = numpy.array([action == state for action in \
+                self._classRows[state]], dtype = numpy.int8)
+            if not loops.any():
+                continue
+            
+            # Every place the loop starts or stops, they take turns so the
+            # starts and ends can be split apart
+            inLoop = loops.take(classes)
+            edges = numpy.flatnonzero(inLoop[1:] != inLoop[:-1]) + 1
+            if inLoop[0]:
+                edges = numpy.insert(edges, 0, 0)
+            if len(edges) % 2:
+                edges = numpy.append(edges, len(inLoop))
+            starts = edges[0::2]
+            ends = edges[1::2]
+            
+            # Only keep the long runs, a pair per run instead of an entry per
+            # character
+            keep = ends - starts >= self.PRE_PASS_MIN_RUN
+            if not keep.any():
+                continue
+            
+            # Plain lists, bisect on them is a lot quicker than on arrays
+            self._runEnds[state] = (starts[keep].tolist(), \
+                ends[keep].tolist())
 
 
 
@@ -68,13 +574,40 @@ class Lex:
         
         self.curToken = ""
         self.curLexemme = ""
+        self.curKind = 0
+        self.curSymbol = -1
+
+
+
+    """
+        brief:  Sets the current token, interning the lexemme
+        params: tok: string, the token or keyword
+        params: image: string, the lexemme
+        post:   Sets current token, lexemme, kind, and symbol
+    """
+    def _setToken(self, tok, image):
+        self.curToken = tok
+        self.curKind = self._kindIds[tok]
+        
+        # Comments are pretty much never repeated, pooling them just wastes
+        # space
+        if tok in Lex.NOT_INTERNED:
+            self.curSymbol = -1
+            self.curLexemme = image
+        else:
+            self.curSymbol, self.curLexemme = self.symbols.intern(image)
 
 
 
     """
         brief:  Constructor
+        params: vectorize: bool, use the NumPy pre-pass if NumPy is installed,
+                defaults to False as the hot state regexes already cover the
+                long loops
+        params: maxSymbols: int, bound on the symbol pool, defaults to None
+                for no limit
     """
-    def __init__(self):
+    def __init__(self, vectorize = False, maxSymbols = None):
     
         # Tables and source code
         self._scanTable = [[]]
@@ -82,14 +615,46 @@ class Lex:
         self._keywordTable = {}
         self._sourceFile = ""
         
+        # Compiled tables, filled in by compileTables
+        self._columns = []
+        self._transitions = [[]]
+        self._stateToken = []
+        self._stateDead = []
+        self._stateRun = {}
+        self._compiled = False
+        self.tableError = ""
+        self._buildCharLookup()
+        
+        # Where the tables came from if a TableRegistry is handing them out,
+        # None when they were read in by hand
+        self._tableSource = None
+        self._tables = None
+        
+        # Token kinds and lexemmes as ints, compare these instead of strings
+        self.kindNames = [""]
+        self._kindIds = {"": 0}
+        self.symbols = SymbolPool(maxSymbols)
+        
         self._index = 0
         
         self.curToken = ""
         self.curLexemme = ""
+        self.curStart = 0
+        self.curKind = 0
+        self.curSymbol = -1
         
         # Used in handling errors
         self.errorFlag = False
         self.errorMessage = ""
+        
+        # Pre-pass results, rebuilt lazily whenever the table or file changes
+        self._vectorize = vectorize and numpy is not None
+        self._runEnds = None
+        self._classes = None
+        self._classRows = None
+        
+        # Characters stepped through one at a time since the scan started
+        self._stepped = 0
 
 
 
@@ -104,11 +669,20 @@ class Lex:
         
             # In try in case file is too large, invalid data, doesn't exist
             newTable = csvReader(fileName)
-            self._index = 0
-            self._scanTable = newTable
-            return True
-        except:
+            columns, transitions = self._validateScanTable(newTable)
+        except (OSError, UnicodeError, ValueError) as error:
+            self.tableError = str(error)
             return False
+            
+        self._index = 0
+        self._scanTable = newTable
+        self._tableSource = None
+        self._columns = columns
+        self._transitions = transitions
+        self._buildCharLookup()
+        self._compiled = False
+        self._runEnds = None
+        return True
 
 
 
@@ -123,13 +697,18 @@ class Lex:
         
             # In try in case file is too large, invalid data, doesn't exist
             newTable = csvReader(fileName)
-            self._index = 0        
-
+            
             # Converts 2D matrix to a 1D list
-            self._tokenTable = [word[0] for word in newTable]
-            return True
-        except:
+            tokenTable = self._validateListTable(newTable, "Token")
+        except (OSError, UnicodeError, ValueError) as error:
+            self.tableError = str(error)
             return False
+            
+        self._index = 0
+        self._tokenTable = tokenTable
+        self._tableSource = None
+        self._compiled = False
+        return True
 
 
 
@@ -144,13 +723,18 @@ class Lex:
         
             # In try in case file is too large, invalid data, doesn't exist
             newTable = csvReader(fileName)
-            self._index = 0
             
             # Converts to a set of keywords
-            self._keywordTable = {word[0] for word in newTable}
-            return True
-        except:
+            keywordTable = set(self._validateListTable(newTable, "Keyword"))
+        except (OSError, UnicodeError, ValueError) as error:
+            self.tableError = str(error)
             return False
+            
+        self._index = 0
+        self._keywordTable = keywordTable
+        self._tableSource = None
+        self._compiled = False
+        return True
 
 
 
@@ -163,17 +747,44 @@ class Lex:
     def readSourceCode(self, fileName):
         try:
         
-            # In try in case file is too large, invalid data, doesn't exist
-            with open(fileName) as file:
+            # In try in case file is too large, invalid data, doesn't exist,
+            # try UTF-8 first and fall back on the system's encoding
+            try:
+                with open(fileName, encoding = "utf-8") as file:
+                    newFile = file.read()
+            except UnicodeDecodeError:
+                with open(fileName) as file:
+                    newFile = file.read()
             
-                # Remove white space from front and end
-                newFile = file.read().strip()
+            # Remove white space from front and end
+            newFile = newFile.strip()
                 
             self._index = 0
+            self._stepped = 0
             self._sourceFile = newFile
-            return True
+            self._runEnds = None
         except:
             return False 
+            
+        # A new file is a new scan, so it can pick up edited tables
+        self.refreshTables()
+        return True
+
+
+
+    """
+        brief:  Uses a string as the source code instead of reading a file
+        params: text: string, the source code
+        post:   The source is replaced and index starts over
+    """
+    def setSourceCode(self, text):
+    
+        # Remove white space from front and end, same as a file
+        self._index = 0
+        self._stepped = 0
+        self._sourceFile = text.strip()
+        self._runEnds = None
+        self.refreshTables()
 
 
 
@@ -189,10 +800,81 @@ class Lex:
     """
         brief:  Sets the index into the file to 0, allows for scanning to 
                 restart from the beginning.
-        post:   self._index is set to 0
+        post:   self._index is set to 0, tables from a TableRegistry are
+                brought up to date
     """
     def restartIndex(self):
         self._index = 0
+        self._stepped = 0
+        self.refreshTables()
+
+
+
+    """
+        brief:  Gets all three tables from a TableRegistry instead of reading
+                them, compiled tables are shared with every other Lex using 
+                the same files
+        params: scanFile: string, the scan table
+        params: tokenFile: string, the token table
+        params: keywordFile: string, the keyword table
+        params: registry: TableRegistry, defaults to the shared tableRegistry
+        post:   Tables are swapped in and index starts over only if loading
+                succeeds
+        return: bool, True or False if the loading succeeded
+    """
+    def useTables(self, scanFile, tokenFile, keywordFile, registry = None):
+        if registry is None:
+            registry = tableRegistry
+        
+        try:
+            tables = registry.get(scanFile, tokenFile, keywordFile, type(self))
+        except (OSError, UnicodeError, ValueError) as error:
+            self.tableError = str(error)
+            return False
+            
+        self._tableSource = (registry, scanFile, tokenFile, keywordFile)
+        self._index = 0
+        self._swapTables(tables)
+        return True
+
+
+
+    """
+        brief:  Checks if the registry has newer tables and swaps them in, 
+                called whenever a new scan starts so one in progress keeps 
+                the tables it started with
+        post:   self.tableError is set if the edited tables are bad, the old
+                ones are kept then
+        return: bool, True if new tables were swapped in
+    """
+    def refreshTables(self):
+        if self._tableSource is None:
+            return False
+            
+        registry, scanFile, tokenFile, keywordFile = self._tableSource
+        try:
+            tables = registry.get(scanFile, tokenFile, keywordFile, type(self))
+        except (OSError, UnicodeError, ValueError) as error:
+            self.tableError = str(error)
+            return False
+        
+        if tables is self._tables:
+            return False
+        
+        self._swapTables(tables)
+        return True
+
+
+
+    """
+        brief:  Puts a compiled table set in place
+        params: tables: dict, attribute name to value, from a TableRegistry
+        post:   All table attributes are replaced together
+    """
+    def _swapTables(self, tables):
+        self.__dict__.update(tables)
+        self._tables = tables
+        self._runEnds = None
 
 
 
@@ -209,12 +891,37 @@ class Lex:
         
         self.errorFlag = False
         self.errorMessage = ""
+        self.curStart = self._index
+        
+        # Bad tables would only blow up below, report it and end the scan
+        if not self._compiled and not self.compileTables():
+            self._handleError("-Invalid tables", [], self.tableError)
+            self._index = len(self._sourceFile)
+            return
+        
+        # The pre-pass is decided on in the per character step below, an
+        # empty one means it was decided against
+        waiting = self._vectorize and self._runEnds is None
+        runEnds = self._runEnds or {}
+        classes = self._classes if self._runEnds is not None else None
+        classRows = self._classRows
+        
+        stateToken = self._stateToken
+        stateDead = self._stateDead
+        stateRun = self._stateRun
         
-        tok = ""
         curChar = ""
         
         image = []
         
+        # Runs are looked up once each time a state is entered, not for
+        # every character
+        runChecked = False
+        
+        # Characters stepped through one at a time, only counted until the
+        # pre-pass is decided on
+        stepped = 0
+        
         # The default start state, 0 is invalid, impossible state
         curState = 1
         
@@ -224,55 +931,599 @@ class Lex:
             
             # End of file is a possible delimter end for tokens
             if self.eof(): 
-                tok = self._tokenTable[curState]
                 
-                # Recognize state, errors prepended with '-'
-                if tok[0] != '-':
+                # Recognize state
+                if stateToken[curState] is not None:
                     break
                     
                 # Error state
                 else:
-                    self._handleError(tok, image, '')
+                    self._stepped += stepped
+                    self._handleError(self._tokenTable[curState], image, '')
                     return
                     
+            # Hot states let their regex find the end of the loop
+            if curState in stateRun:
+                match = stateRun[curState](self._sourceFile, self._index)
+                if match:
+                    image.append(match.group())
+                    self._index = match.end()
+                    continue
+            
+            # Swallow the rest of a long self-loop run found by the pre-pass,
+            # when the character that would make it long enough doesn't loop
+            # there is no point looking it up
+            elif not runChecked and curState in runEnds:
+                runChecked = True
+                ahead = self._index + self.PRE_PASS_MIN_RUN - 1
+                if ahead < len(classes) and \
+                    classRows[curState][classes[ahead]] == curState:
+                    starts, ends = runEnds[curState]
+                    run = bisect_right(starts, self._index) - 1
+                    if run >= 0 and ends[run] - self._index >= \
+                        self.PRE_PASS_MIN_RUN:
+                        image.append(self._sourceFile[self._index:ends[run]])
+                        self._index = ends[run]
+                        continue
+                    
             curChar = self._sourceFile[self._index]
-            self._index += 1
             
-            action = self._findAction(curChar, curState)
+            # The pre-pass already knows every character's column
+            if classes is None:
+                action = self._findAction(curChar, curState)
+                
+                # Once past the start of the file, build the pre-pass if
+                # enough of it was stepped through for it to pay for itself
+                if waiting:
+                    stepped += 1
+                    if self._index >= min(self.PRE_PASS_SAMPLE, \
+                        len(self._sourceFile) - 1):
+                        waiting = False
+                        if self._stepped + stepped >= self._index * \
+                            self.PRE_PASS_MIN_SHARE:
+                            self._buildPrePass()
+                            runEnds = self._runEnds
+                            classes = self._classes
+                            classRows = self._classRows
+                        else:
+                            self._runEnds = {}
+                            self._classes = None
+            else:
+                action = classRows[curState][classes[self._index]]
+            self._index += 1
             
             # Move state
-            if action != '-':
-                curState = int(action)
+            if action:
+                if action != curState:
+                    runChecked = False
+                curState = action
+                image.append(curChar)
+                
+                # Nothing can follow a dead recognize state, stop right here
+                # instead of looking up the next character
+                if stateDead[curState] and stateToken[curState] is not None:
+                    break
                 
             else:
-                tok = self._tokenTable[curState]
                 
-                # Recognize state, errors prepended with '-'
-                if tok[0] != '-':
+                # Recognize state
+                if stateToken[curState] is not None:
                     self._index -= 1
                     break
                 
                 # Error state
                 else:
-                    self._handleError(tok, image, curChar)
+                    self._stepped += stepped
+                    self._handleError(self._tokenTable[curState], image, \
+                        curChar)
                     return
+        
+        self._stepped += stepped
+        tok = stateToken[curState]
+        
+        image = "".join(image)
+        
+        # Check to see if it is a keyword
+        if image in self._keywordTable:
+            tok = image
+            
+        self._setToken(tok, image)
+
+"""
+    Lookahead buffer on top of a Lex for parsers.  Scanned tokens are kept in a
+    ring buffer so peeking ahead and rewinding to a mark never runs the DFA 
+    over the same text twice.  The Lex should not be used directly while a
+    TokenStream is reading from it.
+"""
+class TokenStream:
+
+    """
+        brief:  Constructor
+        params: lexicalAnalyzer: Lex, a Lex object with everything loaded
+        params: skip: set of strings, tokens to throw out, defaults to 
+                whiteSpace and comments like the GUI does
+        params: capacity: int, starting size of the ring buffer, rounded up
+                to a power of two, it grows if marks keep more tokens alive
+    """
+    def __init__(self, lexicalAnalyzer, skip = {"whiteSpace", "comment"}, \
+        capacity = 16):
+        
+        self.lex = lexicalAnalyzer
+        self._skip = set(skip)
+        
+        size = 1
+        while size < capacity:
+            size *= 2
+        self._buffer = [None] * size
+        self._mask = size - 1
+        
+        # Absolute token positions, the buffer holds [_first, _end) and _pos
+        # is the next token advance() hands out
+        self._first = 0
+        self._pos = 0
+        self._end = 0
+        
+        # Outstanding marks, oldest first, tokens from the oldest one on must
+        # stay in the buffer
+        self._marks = []
+
+
+
+    """
+        brief:  Scans one more token into the buffer, doubles the buffer if
+                it is full
+        return: bool, False if end-of-file was hit and nothing was added
+    """
+    def _fill(self):
+    
+        # Keep asking until we get a token that isn't thrown out
+        while True:
+            if self.lex.eof():
+                return False
+            
+            self.lex.getNextToken()
+            if self.lex.curToken not in self._skip:
+                break
+                
+        # Drop tokens nobody can go back to anymore
+        keep = min(self._marks[0], self._pos) if self._marks else self._pos
+        self._first = max(self._first, keep)
+        
+        size = len(self._buffer)
+        if self._end - self._first == size:
+            newBuffer = [None] * (size * 2)
+            newMask = size * 2 - 1
+            for pos in range(self._first, self._end):
+                newBuffer[pos & newMask] = self._buffer[pos & self._mask]
+            self._buffer = newBuffer
+            self._mask = newMask
+        
+        self._buffer[self._end & self._mask] = TokenRecord(self.lex.curToken, \
+            self.lex.curLexemme, self.lex.errorMessage, self.lex.curStart, \
+            self.lex.curKind, self.lex.curSymbol)
+        self._end += 1
+        return True
+
+
+
+    """
+        brief:  Looks at an upcoming token without consuming it
+        params: k: int, how far to look, 1 is the token advance() returns next
+        return: TokenRecord, or None if end-of-file comes first
+        throws: ValueError if k is less than 1
+    """
+    def peek(self, k = 1):
+        if k < 1:
+            raise ValueError("Can only peek at upcoming tokens, not " \
+                "{}".format(k))
+        
+        while self._end - self._pos < k:
+            if not self._fill():
+                return None
+        return self._buffer[(self._pos + k - 1) & self._mask]
+
+
+
+    """
+        brief:  Consumes the next token
+        return: TokenRecord, or None if end-of-file was hit
+    """
+    def advance(self):
+        record = self.peek()
+        if record is not None:
+            self._pos += 1
+        return record
+
+
+
+    """
+        brief:  Remembers the current position so it can be rewound to
+        return: int, the mark to pass to reset or release
+    """
+    def mark(self):
+        self._marks.append(self._pos)
+        return self._pos
+
+
+
+    """
+        brief:  Rewinds to a mark, tokens are replayed from the buffer
+        params: mark: int, a mark from mark() that hasn't been let go yet
+        post:   The mark and any made after it are let go
+        throws: ValueError if the mark isn't active
+    """
+    def reset(self, mark):
+        if mark not in self._marks:
+            raise ValueError("Mark {} is not active".format(mark))
+        
+        # Marks nest, so go back to the newest one made at this position
+        del self._marks[len(self._marks) - self._marks[::-1].index(mark) - 1:]
+        self._pos = mark
+
+
+
+    """
+        brief:  Lets go of a mark without rewinding, once no marks are left
+                the buffer can reuse the space, marks nest so they must be
+                let go of newest first
+        params: mark: int, the newest mark from mark()
+        throws: ValueError if the mark isn't the newest one
+    """
+    def release(self, mark):
+        if not self._marks or self._marks[-1] != mark:
+            raise ValueError("Mark {} is not the newest mark".format(mark))
+        self._marks.pop()
+
+
+
+"""
+    Lexical analyzer that turns the scan table into regexes when the tables
+    are compiled, then matches a whole token per call in C instead of stepping
+    through the DFA.  There is one regex per move out of the start state, so
+    the first character picks the regex and only the tokens that can start
+    with it are tried.  Gives the same tokens and error messages as Lex.
+"""
+class RegexLex(Lex):
+
+    # The start regexes are part of the tables too
+    TABLE_ATTRS = Lex.TABLE_ATTRS + ("_startMatch", "_asciiStart", \
+        "_groupStates")
+
+    """
+        brief:  Finds the regex for every string that takes the DFA from the
+                start state to a target state using state elimination
+        params: target: int, the state to reach
+        return: string, the regex, or None if target can't be reached
+    """
+    def _pathRegex(self, target):
+        # Edges of the DFA labeled with character classes, state 0 is a new
+        # start state with an empty edge into the real one
+        edges = {(0, 1): ""}
+        for state in range(1, len(self._transitions)):
+            for action in set(self._transitions[state]) - {0}:
+                edges[(state, action)] = charClass(self._actionRanges(state, \
+                    lambda move: move == action))
+        
+        # Rip out one state at a time, cheapest first so the regex doesn't
+        # blow up, and patch its paths into the edges around it
+        states = set(range(1, len(self._transitions))) - {target}
+        while states:
+            def cost(state):
+                ins = sum(1 for i, j in edges if j == state and i != state)
+                outs = sum(1 for i, j in edges if i == state and j != state)
+                return ins * outs
+            state = min(states, key = cost)
+            states.remove(state)
+            
+            loop = edges.pop((state, state), None)
+            loop = "" if loop is None else "(?:{})*".format(loop)
             
-            image.append(curChar)
+            ins = [(i, edges.pop((i, j))) for i, j in list(edges) \
+                if j == state]
+            outs = [(j, edges.pop((i, j))) for i, j in list(edges) \
+                if i == state]
+            
+            for i, inRegex in ins:
+                for j, outRegex in outs:
+                    path = inRegex + loop + outRegex
+                    if (i, j) in edges:
+                        path = "(?:{}|{})".format(edges[(i, j)], path)
+                    edges[(i, j)] = path
+        
+        if (0, target) not in edges:
+            return None
+        
+        loop = edges.get((target, target))
+        return edges[(0, target)] + ("" if loop is None else \
+            "(?:{})*".format(loop))
+
+
 
+    """
+        brief:  Builds a named regex group for each state, matching every
+                token the DFA would end in that state
+        pre:    The tables have been compiled
+        return: dict, state to its group
+    """
+    def _buildGroups(self):
+        groups = {}
+        
+        for state in range(1, len(self._transitions)):
+            path = self._pathRegex(state)
+            if path is None:
+                continue
+                
+            # The DFA only stops where the next character has no move
+            moves = self._actionRanges(state, lambda action: action != 0)
+            
+            # Recognize state, don't eat the character that ended it
+            if self._stateToken[state] is not None:
+                stop = "(?!{})".format(charClass(moves)) if moves else ""
+                groups[state] = "(?P<s{}>{}){}".format(state, path, stop)
+            
+            # Error state, eat the bad character like _handleError shows it
+            else:
+                bad = charClass(moves, True)
+                groups[state] = "(?P<s{}>{}(?:{}|\\Z))".format(state, path, \
+                    bad)
+        
+        return groups
+
+
+
+    """
+        brief:  Builds one regex per move out of the start state, each only
+                holds the groups for states the DFA can reach from there, so
+                the engine isn't trying every group on every token
+        pre:    The tables have been compiled
+        post:   self._startMatch maps a move out of the start state, 0 for 
+                none, to the match method of its regex, self._asciiStart is
+                the same for each ASCII character, and self._groupStates 
+                maps group names to states
+    """
+    def _buildStartPatterns(self):
+        groups = self._buildGroups()
+        self._groupStates = {"s{}".format(state): state for state in groups}
+        
+        self._startMatch = {}
+        for action in set(self._transitions[1]) | {0}:
+        
+            # With no move the DFA stays in the start state
+            first = action if action else 1
+            reached = {first}
+            toVisit = [first] if action else []
+            while toVisit:
+                for nextState in self._transitions[toVisit.pop()]:
+                    if nextState and nextState not in reached:
+                        reached.add(nextState)
+                        toVisit.append(nextState)
+            
+            # At most one group can match, so their order doesn't matter
+            self._startMatch[action] = re.compile("|".join(groups[state] \
+                for state in sorted(reached) if state in groups)).match
+        
+        self._asciiStart = [self._startMatch[self._findAction(chr(code), 1)] \
+            for code in range(128)]
+
+
+
+    """
+        brief:  Compiles the tables like Lex does and then the start regexes
+        post:   self._startMatch and self._asciiStart are filled in
+        return: bool, True or False if the tables are usable
+    """
+    def compileTables(self):
+        if not super().compileTables():
+            return False
+            
+        self._buildStartPatterns()
+        return True
+
+
+
+    """
+        brief:  The actual scanning code, one regex match per token
+        pre:    Assumes all tables and files have been read in properly
+        post:   Updates various attributes depending on if a recognize or error
+                state occured
+    """
+    def getNextToken(self):
+
+        # Don't bother exectuing any code below if eof was hit
+        if self.eof(): return
+        
+        self.errorFlag = False
+        self.errorMessage = ""
+        self.curStart = self._index
+        
+        # Bad tables would only blow up below, report it and end the scan
+        if not self._compiled and not self.compileTables():
+            self._handleError("-Invalid tables", [], self.tableError)
+            self._index = len(self._sourceFile)
+            return
+            
+        # The first character picks which regex to try
+        curChar = self._sourceFile[self._index]
+        if curChar < '\x80':
+            match = self._asciiStart[ord(curChar)]
+        else:
+            match = self._startMatch[self._findAction(curChar, 1)]
+        match = match(self._sourceFile, self._index)
+        self._index = match.end()
+        
+        # Group names are the state the DFA would have stopped in
+        state = self._groupStates[match.lastgroup]
+        image = match.group()
+        
+        if self._stateToken[state] is None:
+            self._handleError(self._tokenTable[state], [image], '')
+            return
+        
         # Check to see if it is a keyword
-        if "".join(image) in self._keywordTable:
-            tok = "".join(image)
+        tok = self._stateToken[state]
+        if image in self._keywordTable:
+            tok = image
             
-        self.curToken = tok
-        self.curLexemme = "".join(image)        
+        self._setToken(tok, image)
+
+
+
+"""
+    Cache of compiled tables shared by every Lex that uses it.  Entries are
+    keyed by the table files and checked against their modified times, so an
+    edited table is picked up the next time it is asked for.  Files that 
+    changed on disk but not in content, or the same tables at another path,
+    reuse the compiled copy found by hashing their contents.  Compiled tables
+    are never changed after being built, only replaced, so a Lex in the middle
+    of a scan is safe to keep using the set it has.
+"""
+class TableRegistry:
+
+    """
+        brief:  Constructor
+    """
+    def __init__(self):
+    
+        # (lexClass, paths) to (stamps, compiled tables)
+        self._entries = {}
+        
+        # (lexClass, content hashes) to compiled tables, only for tables some
+        # entry still points at
+        self._byHash = {}
+        
+        self._lock = threading.Lock()
+
+
+
+    """
+        brief:  Gets the modified time and size of each file, cheap enough 
+                to do on every lookup
+        params: paths: tuple of strings, the files
+        return: tuple, one (mtime, size) per file
+    """
+    def _stamp(self, paths):
+        stamps = []
+        for path in paths:
+            info = os.stat(path)
+            stamps.append((info.st_mtime_ns, info.st_size))
+        return tuple(stamps)
+
+
+
+    """
+        brief:  Reads and compiles a table set with a throwaway analyzer
+        params: lexClass: class, Lex or a subclass of it
+        params: paths: tuple of strings, scan, token, and keyword tables
+        return: dict, the compiled table attributes
+        throws: ValueError if the tables are bad
+    """
+    def _compile(self, lexClass, paths):
+        builder = lexClass()
+        scanFile, tokenFile, keywordFile = paths
+        
+        if not (builder.readScanTable(scanFile) and \
+            builder.readTokenTable(tokenFile) and \
+            builder.readKeywordTable(keywordFile) and \
+            builder.compileTables()):
+            raise ValueError(builder.tableError)
+            
+        return {name: getattr(builder, name) for name in lexClass.TABLE_ATTRS}
+
+
+
+    """
+        brief:  Finds the compiled tables for a set of files, compiling them
+                only if they are new or have changed
+        params: scanFile: string, the scan table
+        params: tokenFile: string, the token table
+        params: keywordFile: string, the keyword table
+        params: lexClass: class, Lex or a subclass of it, defaults to Lex
+        return: dict, the compiled table attributes
+        throws: OSError if a file can't be read, ValueError if the tables are
+                bad
+    """
+    def get(self, scanFile, tokenFile, keywordFile, lexClass = Lex):
+        paths = tuple(os.path.abspath(path) for path in \
+            (scanFile, tokenFile, keywordFile))
+        key = (lexClass, paths)
+        
+        # The common case, nothing has changed, is just a few stats
+        stamps = self._stamp(paths)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == stamps:
+            return entry[1]
+            
+        with self._lock:
+        
+            # Go again if a file changes while we're reading it
+            while True:
+                hashes = []
+                for path in paths:
+                    with open(path, 'rb') as file:
+                        hashes.append(hashlib.sha1(file.read()).hexdigest())
+                hashKey = (lexClass, tuple(hashes))
+                
+                tables = self._byHash.get(hashKey)
+                if tables is None:
+                    tables = self._compile(lexClass, paths)
+                
+                newStamps = self._stamp(paths)
+                if newStamps == stamps:
+                    break
+                stamps = newStamps
+                
+            # One assignment each, a reader sees the old entry or the new one
+            self._byHash[hashKey] = tables
+            self._entries[key] = (stamps, tables)
+            
+            # Every edit makes a new set, drop the ones no files point at 
+            # anymore so a long running program doesn't keep them all.  A Lex
+            # still using one keeps its own reference.
+            live = {id(entry[1]) for entry in self._entries.values()}
+            for oldKey in [oldKey for oldKey, oldTables in \
+                self._byHash.items() if id(oldTables) not in live]:
+                del self._byHash[oldKey]
+            return tables
+
+# Shared by default so every Lex using the same tables compiles them once
+tableRegistry = TableRegistry()
+
+# The default tables and test files, from the source folder the scripts and
+# tests are ran from
+DEF_TABLE_DIR = "../tables"
+DEF_SOURCE_DIR = "../testFiles"
+
+DEF_SCAN = DEF_TABLE_DIR + "/DefaultScanTable.csv"
+DEF_TOKEN = DEF_TABLE_DIR + "/DefaultTokenTable.csv"
+DEF_KEY = DEF_TABLE_DIR + "/DefaultKeywordTable.csv"
+DEF_SOURCE = DEF_SOURCE_DIR + "/DefaultTestFile.c"
+
+"""
+    brief:  Makes an analyzer with the default tables read and compiled, 
+            handy for scripts and tests
+    params: lexClass: class, Lex or a subclass of it, defaults to Lex
+    params: hotStates: bool, False turns off the hot state regexes, defaults
+            to True
+    params: vectorize: bool, passed on to the constructor, defaults to False
+    return: Lex, the analyzer with no source code yet
+    throws: OSError if the default tables can't be read
+"""
+def makeLex(lexClass = Lex, hotStates = True, vectorize = False):
+    scanner = lexClass(vectorize)
+    if not hotStates:
+        scanner.HOT_STATE_MIN_CHARS = float("inf")
+    scanner.readScanTable(DEF_SCAN)
+    scanner.readTokenTable(DEF_TOKEN)
+    scanner.readKeywordTable(DEF_KEY)
+    scanner.compileTables()
+    return scanner
+
+
 
 # Test code, only ran when lex.py is ran separately
 if __name__ == "__main__":
-    lex = Lex()
-    lex.readScanTable("../tables/DefaultScanTable.csv")
-    lex.readTokenTable("../tables/DefaultTokenTable.csv")
-    lex.readKeywordTable("../tables/DefaultKeywordTable.csv")
-    lex.readSourceCode("../testFiles/DefaultTestFile.c")
+    lex = makeLex()
+    lex.readSourceCode(DEF_SOURCE)
         
     while not lex.eof(): 
         lex.getNextToken()
@@ -1,15 +1,18 @@
 import unittest
+import tempfile
+import shutil
+import os
 import lex
 import gui
+import batch
+import fingerprint
+from lex import makeLex
 
 class LexTester(unittest.TestCase):
 
     @classmethod
     def setUpClass(self):
-        self.lex = lex.Lex()
-        self.lex.readScanTable("../" + gui.GUI.DEF_SCAN)
-        self.lex.readTokenTable("../" + gui.GUI.DEF_TOKEN)
-        self.lex.readKeywordTable("../" + gui.GUI.DEF_KEY)
+        self.lex = makeLex()
         
         
         
@@ -52,7 +55,7 @@ class LexTester(unittest.TestCase):
         
     
     def testErrors(self):
-        self.lex.setSourceCode("03248231 # \b 12.0e .9E-")
+        self.lex.setSourceCode("03248231 # \\ 12.0e .9E-")
         
         self.lex.getNextToken()
         self.assertEqual(self.lex.errorFlag, True, "Error flag should be True")
@@ -77,5 +80,309 @@ class LexTester(unittest.TestCase):
         self.lex.getNextToken()
         self.assertEqual(self.lex.errorFlag, True, "Error flag should be True")
         self.assertEqual(self.lex.errorMessage, "-Illegal exponation; {e | E}{+ | -} must be followed by {0-9}: .9E-", "Expected illegal exponation")
+        
+        
+        
+    def testFastPaths(self):
+        for fileName in ["DefaultTestFile.c", "errorTest.txt", "keywordTestFile.txt", "tokensTestFile.txt"]:
+            tokens = []
+            
+            # Plain per character stepping first, then the hot state regexes,
+            # the pre-pass, and both together
+            for vectorize, hotStates in [(False, False), (False, True), (True, False), (True, True)]:
+                scanner = makeLex(lex.Lex, hotStates, vectorize)
+                
+                # Files this small would never build the pre-pass or have
+                # runs long enough to jump
+                scanner.PRE_PASS_MIN_SHARE = 0
+                scanner.PRE_PASS_SAMPLE = 0
+                scanner.PRE_PASS_MIN_RUN = 2
+                scanner.readSourceCode("../" + gui.GUI.DEF_SOURCE_DIR + "/" + fileName)
+                
+                found = []
+                while not scanner.eof():
+                    scanner.getNextToken()
+                    found.append((scanner.curToken, scanner.curLexemme, scanner.errorMessage))
+                tokens.append(found)
+                
+                if vectorize and lex.numpy is not None:
+                    self.assertIsNotNone(scanner._runEnds, "Expected the pre-pass to be built")
+                
+            self.assertEqual(tokens[0], tokens[1], "Hot states should not change tokens in " + fileName)
+            self.assertEqual(tokens[0], tokens[2], "Pre-pass should not change tokens in " + fileName)
+            self.assertEqual(tokens[0], tokens[3], "Pre-pass with hot states should not change tokens in " + fileName)
+        
+        # Lone surrogates can't be encoded normally
+        scanner = makeLex(vectorize = True)
+        scanner.PRE_PASS_MIN_SHARE = 0
+        scanner.PRE_PASS_SAMPLE = 0
+        scanner.setSourceCode("int \ud800 x")
+        scanner.getNextToken()
+        self.assertEqual(scanner.curToken, "int", "Expected int before a lone surrogate")
+            
+            
+            
+    def testTableValidation(self):
+        scanner = lex.Lex()
+        with tempfile.TemporaryDirectory() as tempDir:
+            fileName = os.path.join(tempDir, "table.csv")
+            
+            with open(fileName, "w") as file:
+                file.write("32,97\n2,-\n-\n")
+            self.assertFalse(scanner.readScanTable(fileName), "Ragged scan table should be rejected")
+            
+            with open(fileName, "w") as file:
+                file.write("32,97\n2,-\n-,5\n")
+            self.assertFalse(scanner.readScanTable(fileName), "Scan table moving to a missing state should be rejected")
+            
+            with open(fileName, "w") as file:
+                file.write("32,97\n2,-\n2,-\n")
+            self.assertTrue(scanner.readScanTable(fileName), "Trailing newline should be ignored")
+            
+            with open(fileName, "w") as file:
+                file.write("-Impossible state\n-Error\n")
+            self.assertTrue(scanner.readTokenTable(fileName), "Token table should load")
+            self.assertFalse(scanner.compileTables(), "Missing token entry for state 2 should be caught")
+            
+            with open(fileName, "w") as file:
+                file.write("-Impossible state\n-Error\nwhiteSpace\n")
+            scanner.readTokenTable(fileName)
+            self.assertTrue(scanner.compileTables(), scanner.tableError)
+            
+            
+            
+    def testRegexLex(self):
+        for fileName in os.listdir("../" + gui.GUI.DEF_SOURCE_DIR):
+            tokens = []
+            for scanner in [makeLex(), makeLex(lex.RegexLex)]:
+                scanner.readSourceCode("../" + gui.GUI.DEF_SOURCE_DIR + "/" + fileName)
+                
+                found = []
+                while not scanner.eof():
+                    scanner.getNextToken()
+                    found.append((scanner.curToken, scanner.curLexemme, scanner.errorFlag, scanner.errorMessage))
+                tokens.append(found)
+                
+            self.assertEqual(tokens[0], tokens[1], "Start regexes should match the DFA in " + fileName)
+            
+            
+            
+    def testInterning(self):
+        scanner = makeLex()
+        scanner.readSourceCode("../" + gui.GUI.DEF_SOURCE)
+        
+        seen = {}
+        while not scanner.eof():
+            scanner.getNextToken()
+            self.assertEqual(scanner.kindNames[scanner.curKind], scanner.curToken, "Kind id should name the token")
+            
+            if scanner.curToken == "identifier":
+                if scanner.curLexemme in seen:
+                    symbol, lexemme = seen[scanner.curLexemme]
+                    self.assertEqual(scanner.curSymbol, symbol, "Same identifier should get the same symbol")
+                    self.assertIs(scanner.curLexemme, lexemme, "Same identifier should share one string")
+                seen[scanner.curLexemme] = (scanner.curSymbol, scanner.curLexemme)
+                
+        pool = lex.SymbolPool(2)
+        first = pool.intern("x")[0]
+        pool.intern("y")
+        pool.intern("z")
+        self.assertIsNone(pool.name(first), "Oldest symbol should be evicted")
+        self.assertNotEqual(pool.intern("x")[0], first, "Evicted ids should not be reused")
+        
+        
+        
+    def testBatch(self):
+        scanner = makeLex()
+        sourceDir = "../" + gui.GUI.DEF_SOURCE_DIR
+        
+        with tempfile.TemporaryDirectory() as tempDir:
+            outputFile = os.path.join(tempDir, "tokens.txt")
+            index = batch.scanTree(scanner, [sourceDir], outputFile, exclude = ["keyword*"])
+            
+            paths = [info["path"] for info in index.files]
+            self.assertEqual(len(paths), 3, "Expected the keyword test file to be excluded")
+            self.assertEqual(index.filesWithErrors(), [os.path.join(sourceDir, "errorTest.txt")], "Expected only the error test file to have errors")
+            self.assertIn(os.path.join(sourceDir, "DefaultTestFile.c"), index.filesContaining("mult"), "Expected mult in the default test file")
+            
+            # Offsets should pull out exactly the one file's tokens
+            tokens = index.readTokens(os.path.join(sourceDir, "DefaultTestFile.c"))
+            self.assertTrue(tokens.startswith("~ "), "Expected the file header first")
+            self.assertEqual(tokens.count("\n"), index.fileInfo(os.path.join(sourceDir, "DefaultTestFile.c"))["tokens"] + 1, "Expected one line per token")
+            
+            index.save(os.path.join(tempDir, "tokens.json"))
+            loaded = batch.BatchIndex.load(os.path.join(tempDir, "tokens.json"))
+            self.assertEqual(loaded.filesContaining("mult"), index.filesContaining("mult"), "Loaded index should answer the same")
+            
+            
+            
+    def testUnicode(self):
+        with tempfile.TemporaryDirectory() as tempDir:
+            fileName = os.path.join(tempDir, "source.c")
+            with open(fileName, "w", encoding = "utf-8") as file:
+                file.write("/* Grüße, 日本語 */ \"naïve\" é")
+                
+            for scanner in [makeLex(), makeLex(lex.RegexLex)]:
+                scanner.readSourceCode(fileName)
+                
+                scanner.getNextToken()
+                self.assertEqual(scanner.curToken, "comment", "Expected comment")
+                self.assertEqual(scanner.curLexemme, "/* Grüße, 日本語 */", "Expected the whole comment")
+                
+                scanner.getNextToken()
+                scanner.getNextToken()
+                self.assertEqual(scanner.curToken, "string", "Expected string")
+                
+                scanner.getNextToken()
+                scanner.getNextToken()
+                self.assertEqual(scanner.errorMessage, "-Illegal character or backslash out of char or string: é", "Expected é to be illegal outside of comments and strings")
+                
+            # An "other" column catches everything not listed
+            with open(fileName, "w") as file:
+                file.write("97,128-255,other\n2,-,3\n2,-,-\n-,-,-\n")
+            scanner = lex.Lex()
+            self.assertTrue(scanner.readScanTable(fileName), scanner.tableError)
+            self.assertEqual(scanner._findAction("a", 1), 2, "Expected a to use its own column")
+            self.assertEqual(scanner._findAction("é", 1), 0, "Expected é to use the range column")
+            self.assertEqual(scanner._findAction("日", 1), 3, "Expected 日 to use the other column")
+            
+            with open(fileName, "w") as file:
+                file.write("97,90-100\n-,-\n")
+            self.assertFalse(scanner.readScanTable(fileName), "Overlapping columns should be rejected")
+            
+            
+            
+    def testTableRegistry(self):
+        with tempfile.TemporaryDirectory() as tempDir:
+            paths = []
+            for fileName in [gui.GUI.DEF_SCAN, gui.GUI.DEF_TOKEN, gui.GUI.DEF_KEY]:
+                paths.append(shutil.copy("../" + fileName, tempDir))
+                
+            registry = lex.TableRegistry()
+            first = lex.Lex()
+            second = lex.Lex()
+            self.assertTrue(first.useTables(*paths, registry = registry), first.tableError)
+            self.assertTrue(second.useTables(*paths, registry = registry), second.tableError)
+            self.assertIs(registry.get(*paths), registry.get(*paths), "Unchanged tables should not be compiled again")
+            
+            first.setSourceCode("int x y")
+            first.getNextToken()
+            
+            # Edit the token table, make sure the modified time moves
+            with open(paths[1]) as file:
+                text = file.read().replace("identifier", "name")
+            with open(paths[1], "w") as file:
+                file.write(text)
+            stat = os.stat(paths[1])
+            os.utime(paths[1], ns = (stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            
+            first.getNextToken()
+            first.getNextToken()
+            self.assertEqual(first.curToken, "identifier", "Scan in progress should keep its tables")
+            
+            first.restartIndex()
+            first.getNextToken()
+            first.getNextToken()
+            first.getNextToken()
+            self.assertEqual(first.curToken, "name", "Restarting should pick up the edited table")
+            
+            second.refreshTables()
+            self.assertIs(first._tables, second._tables, "Both analyzers should share the new tables")
+            
+            # Old versions of edited tables shouldn't pile up
+            for i in range(5):
+                with open(paths[2], "a") as file:
+                    file.write("\nextra{}".format(i))
+                stat = os.stat(paths[2])
+                os.utime(paths[2], ns = (stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+                first.restartIndex()
+            self.assertEqual(len(registry._byHash), 1, "Only the newest tables should be cached")
+            
+            
+            
+    def testTokenStream(self):
+        scanner = makeLex()
+        scanner.readSourceCode("../" + gui.GUI.DEF_SOURCE)
+        stream = lex.TokenStream(scanner, capacity = 2)
+        
+        self.assertEqual(stream.peek(3).lexemme, "(", "Expected ( three tokens ahead")
+        self.assertEqual(stream.advance().token, "int", "Expected int")
+        
+        mark = stream.mark()
+        lexemmes = [stream.advance().lexemme for i in range(10)]
+        self.assertEqual(lexemmes[:4], ["main", "(", "int", "argc"], "Expected main(int argc")
+        
+        stream.reset(mark)
+        self.assertEqual([stream.advance().lexemme for i in range(10)], lexemmes, "Reset should replay the same tokens")
+        
+        # Both x's coming up should share one symbol
+        self.assertEqual(stream.peek(4).lexemme, "x", "Expected x four tokens ahead")
+        self.assertEqual(stream.peek(16).lexemme, "x", "Expected x sixteen tokens ahead")
+        self.assertEqual(stream.peek(4).symbol, stream.peek(16).symbol, "Same lexemme should get the same symbol")
+        self.assertEqual(scanner.symbols.name(stream.peek(4).symbol), "x", "Symbol should name the lexemme")
+        
+        self.assertRaises(ValueError, stream.peek, 0)
+        self.assertRaises(ValueError, stream.peek, -1)
+        
+        # Marks are let go of innermost first
+        outer = stream.mark()
+        stream.advance()
+        inner = stream.mark()
+        self.assertRaises(ValueError, stream.release, outer)
+        stream.release(inner)
+        stream.release(outer)
+        
+        while stream.advance() is not None:
+            pass
+        self.assertIsNone(stream.peek(), "Expected nothing left after end-of-file")
+            
+            
+            
+    def testFingerprints(self):
+        scanner = makeLex()
+        with open("../" + gui.GUI.DEF_SOURCE) as file:
+            original = file.read()
+        
+        with tempfile.TemporaryDirectory() as tempDir:
+            copied = os.path.join(tempDir, "copied.c")
+            other = os.path.join(tempDir, "other.c")
+            with open(os.path.join(tempDir, "original.c"), "w") as file:
+                file.write(original)
+            
+            # Renamed and moved down, should still be found
+            with open(copied, "w") as file:
+                file.write("float pad = 1.5;\n\n" + original.replace("sum", "add").replace("argc", "count"))
+            with open(other, "w") as file:
+                file.write("char c = 'q';\n" * 20)
+            
+            index = fingerprint.FingerprintIndex(os.path.join(tempDir, "prints.db"), scanner)
+            self.assertEqual(len(index.updateTree([tempDir], ["*.c"])), 3, "Expected every file to be scanned")
+            self.assertEqual(index.updateTree([tempDir], ["*.c"]), [], "Unchanged files shouldn't be scanned again")
+            
+            regions = index.duplicates(copied)
+            self.assertEqual([region[0] for region in regions], [os.path.abspath(os.path.join(tempDir, "original.c"))], "Expected only the original to match")
+            self.assertEqual(regions[0][1], 3, "Expected the copy to start on line 3")
+            self.assertEqual(regions[0][3], 1, "Expected the original to start on line 1")
+            self.assertEqual(index.duplicates(other), [], "Expected nothing like the other file")
+            
+            # Only the changed file gets scanned, and its old prints are gone
+            with open(copied, "w") as file:
+                file.write("int unrelated;")
+            self.assertEqual(index.updateTree([tempDir], ["*.c"]), [copied], "Expected only the changed file to be scanned")
+            self.assertEqual(index.duplicates(copied), [], "Old fingerprints should be replaced")
+            
+            os.remove(other)
+            index.updateTree([tempDir], ["*.c"])
+            self.assertRaises(KeyError, index.duplicates, other)
+            index.close()
+            
+            # Exact mode counts renamed identifiers as different
+            exact = fingerprint.FingerprintIndex(":memory:", scanner, normalize = False)
+            with open(copied, "w") as file:
+                file.write(original.replace("x", "q").replace("y", "r").replace("z", "s").replace("a", "e").replace("b", "d"))
+            exact.updateTree([tempDir], ["*.c"])
+            self.assertEqual(exact.duplicates(copied), [], "Renamed code shouldn't match in exact mode")
+            self.assertRaises(ValueError, fingerprint.FingerprintIndex, os.path.join(tempDir, "prints.db"), scanner, normalize = False)
 
-unittest.main()
\ No newline at end of file
+if __name__ == "__main__":
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,253 @@
+import unittest
+import tempfile
+import tracemalloc
+import random
+import time
+import os
+import lex
+import batch
+from lex import makeLex
+
+# Floors and ceilings are set well below what a normal machine does so only a
+# real slow down trips them, not a busy computer
+MIN_TOKENS_PER_SEC = 25000
+MIN_BATCH_TOKENS_PER_SEC = 15000
+MAX_PEAK_BYTES = 1024 * 1024
+
+# A clean scan holds a couple hundred blocks no matter the size of the input,
+# keeping even one block per token would be thousands
+MAX_EXTRA_BLOCKS = 50
+WINDOW_TOKENS = 2000
+MAX_WINDOW_BLOCKS = 20
+
+# Four times the input should take about four times as long, quadratic
+# scanning would take sixteen
+MAX_GROWTH = 10
+
+# The pre-pass should never cost more than timing noise, two of the same
+# scanner already differ by a few percent
+MAX_PRE_PASS_SLOWDOWN = 1.1
+
+"""
+    brief:  Makes a C like source file, same seed gives the same text
+    params: lines: int, number of lines to make
+    params: seed: int, seed for the random choices
+    return: string, the source code
+"""
+def makeCorpus(lines, seed = 305):
+    rand = random.Random(seed)
+    names = ["count", "index", "total", "value", "x", "y", "sum", "mult"]
+    
+    text = []
+    for i in range(lines):
+        a = rand.choice(names)
+        b = rand.choice(names)
+        text.append(rand.choice([
+            "int {} = {} + {};".format(a, b, rand.randint(0, 99)),
+            "    {} += mult({}, 0x1F) * 2.5e3;".format(a, b),
+            "/* comment about {} and {} */".format(a, b),
+            "if ({} == {}) return \"done\";".format(a, b),
+            "float {} = .25; char c = 'q';".format(a)]))
+    return "\n".join(text)
+
+"""
+    brief:  Scans all of a string
+    params: scanner: Lex, the analyzer to use
+    params: text: string, the source code
+    return: tuple, the number of tokens and the seconds it took
+"""
+def scanAll(scanner, text):
+    scanner.setSourceCode(text)
+    
+    count = 0
+    start = time.perf_counter()
+    while not scanner.eof():
+        scanner.getNextToken()
+        count += 1
+    return count, time.perf_counter() - start
+
+"""
+    brief:  Counts the blocks tracemalloc sees allocated right now
+    pre:    tracemalloc is running
+    return: int, the number of blocks
+"""
+def countBlocks():
+    return sum(stat.count for stat in \
+        tracemalloc.take_snapshot().statistics("filename"))
+
+"""
+    brief:  Scans some tokens and counts the blocks left behind
+    pre:    tracemalloc is running
+    params: scanner: Lex, the analyzer to use, with source loaded
+    params: calls: int, how many times to call getNextToken
+    return: int, blocks held after the calls that weren't before
+"""
+def windowBlocks(scanner, calls):
+    start = countBlocks()
+    for i in range(calls):
+        scanner.getNextToken()
+    return countBlocks() - start
+
+"""
+    brief:  Scans a string with tracemalloc running
+    params: scanner: Lex, the analyzer to use
+    params: text: string, the source code
+    return: tuple, number of tokens, peak bytes, and blocks still held after,
+            both counted from when scanning started
+"""
+def traceScan(scanner, text):
+    scanner.setSourceCode(text)
+    
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        
+        count = 0
+        while not scanner.eof():
+            scanner.getNextToken()
+            count += 1
+        
+        peak = tracemalloc.get_traced_memory()[1] - start
+        blocks = countBlocks()
+    finally:
+        tracemalloc.stop()
+    
+    return count, peak, blocks
+
+class PerfTester(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        self.corpus = makeCorpus(8000)
+
+
+
+    def testThroughput(self):
+        for lexClass in [lex.Lex, lex.RegexLex]:
+            scanner = makeLex(lexClass)
+            
+            # Best of three so one hiccup doesn't fail the test
+            count, seconds = min(scanAll(scanner, self.corpus) for i in range(3))
+            self.assertGreater(count / seconds, MIN_TOKENS_PER_SEC, "{} is scanning too slow".format(lexClass.__name__))
+
+
+
+    def testRegexLexFaster(self):
+        scanners = [makeLex(lex.Lex), makeLex(lex.RegexLex)]
+        
+        # Take turns so a busy moment slows both down, not just one
+        best = [float("inf"), float("inf")]
+        for i in range(5):
+            for which, scanner in enumerate(scanners):
+                best[which] = min(best[which], scanAll(scanner, self.corpus)[1])
+        
+        self.assertLessEqual(best[1], best[0], "RegexLex should be at least as fast as Lex")
+
+
+
+    @unittest.skipIf(lex.numpy is None, "NumPy is not installed")
+    def testPrePassNotSlower(self):
+        
+        # Lots of white space and comments, both as many short tokens and as
+        # one long token the hot state regexes eat on their own
+        texts = {
+            "mixed": "\n".join("    /* comment about x and y */   \t  x = 0{};".format(i % 8) * 3 for i in range(5000)),
+            "comment": "/* " + "lorem ipsum * dolor " * 50000 + " */",
+            "whiteSpace": "a" + " \n\t " * 500000 + "a"}
+        
+        for name, text in texts.items():
+            scanners = [makeLex(lex.Lex), makeLex(lex.Lex, vectorize = True)]
+            
+            # Take turns so a busy moment slows both down, not just one, the
+            # pre-pass is built inside the timing
+            best = [float("inf"), float("inf")]
+            for i in range(5):
+                for which, scanner in enumerate(scanners):
+                    best[which] = min(best[which], scanAll(scanner, text)[1])
+            
+            self.assertLessEqual(best[1], best[0] * MAX_PRE_PASS_SLOWDOWN, "The pre-pass should not make scanning {} slower".format(name))
+
+
+
+    def testBatchThroughput(self):
+        scanner = makeLex(lex.Lex)
+        
+        with tempfile.TemporaryDirectory() as tempDir:
+            for i in range(20):
+                with open(os.path.join(tempDir, "file{}.c".format(i)), "w") as file:
+                    file.write(makeCorpus(500, i))
+            
+            outputFile = os.path.join(tempDir, "tokens.out")
+            start = time.perf_counter()
+            index = batch.scanTree(scanner, [tempDir], outputFile, ["*.c"])
+            seconds = time.perf_counter() - start
+            
+            # The index leaves out whiteSpace and comments, so this is a lower
+            # bound on what was really scanned
+            count = sum(info["tokens"] for info in index.files)
+            self.assertEqual(len(index.files), 20, "Expected every file to be scanned")
+            self.assertGreater(count / seconds, MIN_BATCH_TOKENS_PER_SEC, "Batch scanning is too slow")
+
+
+
+    def testMemory(self):
+        for lexClass in [lex.Lex, lex.RegexLex]:
+            count, peak, blocks = traceScan(makeLex(lexClass), makeCorpus(4000))
+            self.assertLess(peak, MAX_PEAK_BYTES, "{} is using too much memory".format(lexClass.__name__))
+
+
+
+    def testAllocationsPerToken(self):
+        for lexClass in [lex.Lex, lex.RegexLex]:
+            small = traceScan(makeLex(lexClass), makeCorpus(2000))
+            large = traceScan(makeLex(lexClass), makeCorpus(8000))
+            
+            # Only the symbol pool should hold on to anything, and it only
+            # grows with new names, so four times the tokens can't hold more
+            self.assertLess(large[2], small[2] + MAX_EXTRA_BLOCKS, "{} is holding on to memory per token".format(lexClass.__name__))
+            self.assertLess(large[1], 2 * small[1], "{} peak memory grows with the number of tokens".format(lexClass.__name__))
+            
+            # Scan it once so every name is already pooled, then the same
+            # number of tokens at the start and end should leave the same
+            # blocks behind, next to none
+            scanner = makeLex(lexClass)
+            text = makeCorpus(8000)
+            count = scanAll(scanner, text)[0]
+            scanner.setSourceCode(text)
+            
+            tracemalloc.start()
+            try:
+                first = windowBlocks(scanner, WINDOW_TOKENS)
+                for i in range(count - 2 * WINDOW_TOKENS):
+                    scanner.getNextToken()
+                last = windowBlocks(scanner, WINDOW_TOKENS)
+            finally:
+                tracemalloc.stop()
+            
+            self.assertTrue(scanner.eof(), "Expected the last window to end the file")
+            self.assertLess(first, MAX_WINDOW_BLOCKS, "{} holds on to blocks while scanning".format(lexClass.__name__))
+            self.assertAlmostEqual(first, last, delta = MAX_WINDOW_BLOCKS, msg = "{} holds on to more blocks later in the file".format(lexClass.__name__))
+
+
+
+    def testLongTokens(self):
+        makers = {
+            "comment": lambda size: "/* " + "lorem ipsum * dolor " * (size // 20) + " */",
+            "identifier": lambda size: "x" * size,
+            "string": lambda size: "\"" + "abc def " * (size // 8) + "\"",
+            "whiteSpace": lambda size: "a" + " \n\t " * (size // 4) + "a",
+            "intLiteral": lambda size: "1" * size}
+        
+        for lexClass, hotStates in [(lex.Lex, True), (lex.Lex, False), (lex.RegexLex, True)]:
+            scanner = makeLex(lexClass, hotStates)
+            
+            # Kept under a few hundred thousand characters, past that copying
+            # the lexemme gets slower per character on some machines
+            for name, maker in makers.items():
+                small = min(scanAll(scanner, maker(50000))[1] for i in range(5))
+                large = min(scanAll(scanner, maker(200000))[1] for i in range(5))
+                
+                self.assertLess(large, MAX_GROWTH * small + 0.005, "{} scans long {} tokens in worse than linear time".format(lexClass.__name__, name))
+
+if __name__ == "__main__":
+    unittest.main()
\ No newline at end of file